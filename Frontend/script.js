@@ -5,7 +5,7 @@
        /generate_audio_sdk  (POST JSON {text})       → Convert text to audio
        /tts/echo            (POST file)              → Echo back with audio
        /transcribe/file     (POST file)              → Get text transcription
-       /llm/query           (POST JSON/FormData)     → LLM response + TTS
+       /agent/chat/:id/stream (POST FormData)        → NDJSON: transcription, then audio per sentence
    =============================== */
 
 /* =========================================================
@@ -53,6 +53,59 @@ function appendUserBubble(text) {
   return div;
 }
 
+/* Send a chat turn to the streaming endpoint and play each sentence's
+   audio as soon as it arrives, queued back to back. */
+async function streamChat(form, onTranscription) {
+  const res = await fetch(`/agent/chat/${sessionId}/stream`, {
+    method: "POST",
+    body: form,
+  });
+  if (!res.ok || !res.body) throw new Error("Chat request failed");
+
+  let botDiv = null;
+  const player = new Audio();
+  const audioQueue = [];
+  let playing = false;
+
+  function playNext() {
+    if (audioQueue.length === 0) {
+      playing = false;
+      return;
+    }
+    playing = true;
+    player.src = audioQueue.shift();
+    player.play().catch(playNext);
+  }
+  player.addEventListener("ended", playNext);
+
+  function handleEvent(event) {
+    if ("transcription" in event) {
+      onTranscription(event.transcription);
+      return;
+    }
+    if (!botDiv) botDiv = appendBotBubble("");
+    botDiv.innerText = botDiv.innerText ? `${botDiv.innerText} ${event.text}` : event.text;
+    audioQueue.push(event.audio_url);
+    if (!playing) playNext();
+    scrollToBottom();
+  }
+
+  const reader = res.body.getReader();
+  const decoder = new TextDecoder();
+  let buffer = "";
+  while (true) {
+    const { value, done } = await reader.read();
+    if (done) break;
+    buffer += decoder.decode(value, { stream: true });
+    let newline;
+    while ((newline = buffer.indexOf("\n")) >= 0) {
+      const line = buffer.slice(0, newline).trim();
+      buffer = buffer.slice(newline + 1);
+      if (line) handleEvent(JSON.parse(line));
+    }
+  }
+}
+
 /* =========================================================
    3. TEXT MODE: User text → LLM → TTS
    ========================================================= */
@@ -68,25 +121,13 @@ async function generateAudio() {
   const form = new FormData();
   form.append("text", inputText);
 
-  const res = await fetch(`/agent/chat/${sessionId}`, {
-    method: "POST",
-    body: form,
-  });
-
-  const data = await res.json();
-  status.remove();
-
-  appendBotBubble(data.llm_text);
-
-  const botDiv = document.createElement("div");
-  botDiv.className = "bot-message";
-  const audio = document.createElement("audio");
-  audio.controls = true;
-  audio.autoplay = true;
-  audio.src = data.audio_url;
-  botDiv.appendChild(audio);
-  chatArea.appendChild(botDiv);
-  scrollToBottom();
+  try {
+    await streamChat(form, () => status.remove());
+  } catch (err) {
+    console.error(err);
+    status.remove();
+    appendBotBubble("❌ There was a problem getting a response.");
+  }
 }
 
 sendBtn.addEventListener("click", generateAudio);
@@ -131,27 +172,10 @@ recordBtn.addEventListener("click", async () => {
           const form = new FormData();
           form.append("file", blob, "recording.webm");
 
-          const res = await fetch(`/agent/chat/${sessionId}`, {
-            method: "POST",
-            body: form,
+          await streamChat(form, (transcription) => {
+            status.remove();
+            appendUserBubble(transcription);
           });
-
-          if (!res.ok) throw new Error("LLM query failed");
-          const data = await res.json();
-
-          status.remove();
-          appendUserBubble(data.transcription);
-          appendBotBubble(data.llm_text);
-
-          const botDiv = document.createElement("div");
-          botDiv.className = "bot-message";
-          const audio = document.createElement("audio");
-          audio.controls = true;
-          audio.autoplay = true;
-          audio.src = data.audio_url;
-          botDiv.appendChild(audio);
-          chatArea.appendChild(botDiv);
-          scrollToBottom();
         } catch (err) {
           console.error(err);
           status.remove();
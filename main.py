@@ -6,19 +6,30 @@ main.py - AI Voice Agent with Gemini LLM, Murf TTS, and AssemblyAI Transcription
 # 1. Imports
 # ================================
 import os
+import asyncio
+import hashlib
+import json
+import re
+import shutil
 from dotenv import load_dotenv
 import google.generativeai as genai
-import assemblyai as aai
 import uuid
-
-from fastapi import FastAPI, File, UploadFile, Request
-from fastapi.responses import JSONResponse, FileResponse
+from concurrent.futures import ThreadPoolExecutor
+import anyio
+import aiofiles
+import aiofiles.os
+import aiohttp
+import redis.asyncio as aioredis
+from redis.exceptions import WatchError
+from cachetools import LRUCache, TTLCache
+
+from fastapi import FastAPI, File, Form, HTTPException, UploadFile, Request
+from fastapi.responses import JSONResponse, FileResponse, StreamingResponse
 from fastapi.staticfiles import StaticFiles
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel
 from fastapi.staticfiles import StaticFiles
 
-from murf import Murf
 from murf.core.api_error import ApiError
 
 
@@ -26,7 +37,6 @@ from murf.core.api_error import ApiError
 # 2. Environment Variables
 # ================================
 load_dotenv()
-chat_history_store = {}
 # -- Gemini API Key --
 GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
 if not GEMINI_API_KEY:
@@ -37,7 +47,6 @@ genai.configure(api_key=GEMINI_API_KEY)
 ASSEMBLYAI_API_KEY = os.getenv("ASSEMBLYAI_API_KEY")
 if not ASSEMBLYAI_API_KEY:
     raise RuntimeError("Missing ASSEMBLYAI_API_KEY. Please set it in your .env file or environment.")
-aai.settings.api_key = ASSEMBLYAI_API_KEY
 
 # -- Murf API Key --
 MURF_API_KEY = os.getenv("MURF_API_KEY")
@@ -51,8 +60,29 @@ if not MURF_API_KEY:
 # Gemini LLM Model
 llm_model = genai.GenerativeModel("gemini-1.5-flash")
 
-# Murf TTS Client
-client = Murf(api_key=MURF_API_KEY)
+# Murf TTS (REST API)
+MURF_TTS_URL = "https://api.murf.ai/v1/speech/generate"
+MURF_VOICE_ID = "en-US-natalie"
+
+# Shared async HTTP session, opened on startup and closed on shutdown.
+# Idle connections are kept longer than aiohttp's 15s default so the TLS
+# connections to Murf and AssemblyAI survive the pause between voice turns.
+http_session: aiohttp.ClientSession | None = None
+HTTP_KEEPALIVE_SECONDS = 120
+
+# Caps on in-flight provider calls; excess requests wait here instead of
+# hitting the provider's concurrency limit and getting 429s back. A slot is
+# held for one HTTP request at a time, never across a backoff or poll sleep.
+STT_CONCURRENCY = int(os.getenv("STT_CONCURRENCY", "8"))
+TTS_CONCURRENCY = int(os.getenv("TTS_CONCURRENCY", "16"))
+STT_SEM = asyncio.Semaphore(STT_CONCURRENCY)
+TTS_SEM = asyncio.Semaphore(TTS_CONCURRENCY)
+RATE_LIMIT_RETRIES = 4
+RATE_LIMIT_BACKOFF_SECONDS = 0.5
+MAX_POLL_BACKOFF_SECONDS = 30
+# Upper bound on submitting and waiting for one transcript, so a stuck job
+# cannot keep a request waiting forever
+STT_TIMEOUT_SECONDS = int(os.getenv("STT_TIMEOUT_SECONDS", "120"))
 
 
 # ================================
@@ -72,17 +102,43 @@ app.add_middleware(
 # Serve frontend files
 app.mount("/Frontend", StaticFiles(directory="Frontend", html=True), name="frontend")
 
+# Upper bound on worker threads for the remaining blocking SDK calls
+THREADPOOL_SIZE = int(os.getenv("THREADPOOL_SIZE", "8"))
+
+
+@app.on_event("startup")
+async def size_threadpools():
+    """Cap both anyio's and asyncio's default thread pools at THREADPOOL_SIZE"""
+    anyio.to_thread.current_default_thread_limiter().total_tokens = THREADPOOL_SIZE
+    asyncio.get_running_loop().set_default_executor(ThreadPoolExecutor(max_workers=THREADPOOL_SIZE))
+
+
+@app.on_event("startup")
+async def open_http_session():
+    """Create the shared aiohttp session used for outbound API calls"""
+    global http_session
+    http_session = aiohttp.ClientSession(
+        connector=aiohttp.TCPConnector(keepalive_timeout=HTTP_KEEPALIVE_SECONDS, ttl_dns_cache=300)
+    )
+
+
+@app.on_event("shutdown")
+async def close_http_session():
+    """Close the shared aiohttp session"""
+    if http_session is not None:
+        await http_session.close()
+
 
 # ================================
 # 5. Routes - General
 # ================================
 @app.get("/")
-def serve_home():
+async def serve_home():
     """Serve index.html at root"""
     return FileResponse(os.path.join("Frontend","index.html"))
 
 @app.get("/ping")
-def ping():
+async def ping():
     """Health check endpoint"""
     return {"message": "server running successfully"}
 
@@ -93,16 +149,53 @@ def ping():
 class TextInput(BaseModel):
     text: str
 
+
+# Cache of synthesized audio URLs keyed by (voice, format, text).
+# Murf audio links expire, so entries are dropped well before that happens.
+tts_cache = TTLCache(maxsize=1024, ttl=24 * 60 * 60)
+
+
+def tts_cache_key(text: str, voice: str, fmt: str) -> str:
+    return hashlib.blake2b(f"{voice}|{fmt}|{text}".encode()).hexdigest()
+
+
+async def murf_generate(text: str, voice: str = MURF_VOICE_ID, fmt: str = "MP3") -> str:
+    """Call the Murf REST API without blocking the event loop and return the audio URL.
+
+    429 responses are retried with exponential backoff, outside the semaphore.
+    """
+    for attempt in range(RATE_LIMIT_RETRIES + 1):
+        async with TTS_SEM:
+            async with http_session.post(
+                MURF_TTS_URL,
+                json={"text": text, "voiceId": voice, "format": fmt},
+                headers={"api-key": MURF_API_KEY},
+            ) as resp:
+                if resp.status == 200:
+                    data = await resp.json()
+                    return data["audioFile"]
+                body = await resp.text()
+        if resp.status != 429 or attempt == RATE_LIMIT_RETRIES:
+            raise ApiError(status_code=resp.status, body=body)
+        await asyncio.sleep(RATE_LIMIT_BACKOFF_SECONDS * 2 ** attempt)
+
+
+async def synth(text: str, voice: str = MURF_VOICE_ID, fmt: str = "MP3") -> str:
+    """Return the audio URL for text, only calling Murf on a cache miss"""
+    key = tts_cache_key(text, voice, fmt)
+    audio_url = tts_cache.get(key)
+    if audio_url is None:
+        audio_url = await murf_generate(text, voice, fmt)
+        tts_cache[key] = audio_url
+    return audio_url
+
+
 @app.post("/generate_audio_sdk")
 async def generate_audio_sdk(input: TextInput):
     """Generate TTS audio from text using Murf API"""
     try:
-        res = client.text_to_speech.generate(
-            text=input.text,
-            voice_id="en-US-natalie",
-            format="MP3"
-        )
-        return {"audio_url": res.audio_file}
+        audio_url = await synth(input.text)
+        return {"audio_url": audio_url}
     except ApiError as e:
         return {"error": f"{e.status_code}", "detail": e.body}
 
@@ -113,32 +206,280 @@ async def generate_audio_sdk(input: TextInput):
 UPLOAD_DIR = "uploads"
 os.makedirs(UPLOAD_DIR, exist_ok=True)
 
+# Raw recordings stay private; only audio the server generates itself is
+# served, from its own directory under /audio/...
+GENERATED_AUDIO_DIR = "generated_audio"
+os.makedirs(GENERATED_AUDIO_DIR, exist_ok=True)
+app.mount("/audio", StaticFiles(directory=GENERATED_AUDIO_DIR), name="audio")
+
+# Uploads are copied to disk in fixed-size chunks so a recording is never held in memory whole
+CHUNK_SIZE = 1 << 20
+
+
+# Stored uploads are named by a hash of their content, never by the client's
+# filename, so a crafted name cannot escape UPLOAD_DIR and re-sends dedupe.
+# Only known audio extensions are kept; anything else is stored as .bin
+AUDIO_EXTENSIONS = {".webm", ".ogg", ".wav", ".mp3", ".m4a"}
+
+
+def new_hasher():
+    return hashlib.blake2b(digest_size=16)
+
+
+def temp_upload_path() -> str:
+    return os.path.join(UPLOAD_DIR, f"{uuid.uuid4()}.part")
+
+
+async def store_by_hash(temp_path: str, digest: str, filename: str | None) -> str:
+    """Move a fully written upload to its content-addressed path, dropping it if already stored"""
+    ext = os.path.splitext(filename or "")[1].lower()
+    if ext not in AUDIO_EXTENSIONS:
+        ext = ".bin"
+    path = os.path.join(UPLOAD_DIR, f"{digest}{ext}")
+    if await aiofiles.os.path.exists(path):
+        await aiofiles.os.remove(temp_path)
+    else:
+        await aiofiles.os.replace(temp_path, path)
+    return path
+
+
+async def save_upload(file: UploadFile) -> tuple[str, int]:
+    """Stream an uploaded file to disk chunk by chunk, returning its stored path and size"""
+    temp_path = temp_upload_path()
+    hasher = new_hasher()
+    size = 0
+    async with aiofiles.open(temp_path, "wb") as f:
+        while chunk := await file.read(CHUNK_SIZE):
+            hasher.update(chunk)
+            await f.write(chunk)
+            size += len(chunk)
+    path = await store_by_hash(temp_path, hasher.hexdigest(), file.filename)
+    return path, size
+
+
 @app.post("/upload_audio")
 async def upload_audio(file: UploadFile = File(...)):
     """Upload audio file and store it locally"""
-    file_path = os.path.join(UPLOAD_DIR, file.filename)
-    content = await file.read()
-    with open(file_path, "wb") as f:
-        f.write(content)
+    file_path, size = await save_upload(file)
     return JSONResponse({
         "filename": file.filename,
+        "stored_as": os.path.basename(file_path),
         "content_type": file.content_type,
-        "size_bytes": len(content)
+        "size_bytes": size
     })
 
 
 # ================================
 # 8. Routes - AssemblyAI Transcription
 # ================================
+AAI_UPLOAD_URL = "https://api.assemblyai.com/v2/upload"
+AAI_TRANSCRIPT_URL = "https://api.assemblyai.com/v2/transcript"
+TRANSCRIPT_POLL_SECONDS = 1
+
+# Recordings larger than this are rejected before anything is sent to AssemblyAI
+MAX_UPLOAD_BYTES = int(os.getenv("MAX_UPLOAD_BYTES", str(25 * 1024 * 1024)))
+
+# When ffmpeg is available, audio is re-encoded to 16kHz mono Opus before upload;
+# that is all speech recognition needs and is far smaller than browser recordings.
+FFMPEG_PATH = shutil.which("ffmpeg")
+FFMPEG_ARGS = ["-loglevel", "error", "-i", "pipe:0", "-ac", "1", "-ar", "16000",
+               "-c:a", "libopus", "-b:a", "24k", "-f", "ogg", "pipe:1"]
+
+# ffmpeg can only demux containers that stream from a pipe. MP4/M4A files often
+# put their index at the end, so anything not listed here is uploaded as-is.
+STREAMABLE_AUDIO_TYPES = {"audio/webm", "video/webm", "audio/ogg", "audio/opus",
+                          "audio/wav", "audio/x-wav", "audio/wave"}
+STREAMABLE_AUDIO_EXTENSIONS = {".webm", ".ogg", ".oga", ".opus", ".wav"}
+
+
+def check_upload_size(file: UploadFile):
+    """Raise 413 for uploads over MAX_UPLOAD_BYTES"""
+    if file.size is not None and file.size > MAX_UPLOAD_BYTES:
+        raise HTTPException(status_code=413, detail=f"Audio file exceeds {MAX_UPLOAD_BYTES} bytes")
+
+
+def can_transcode(file: UploadFile) -> bool:
+    """Whether ffmpeg is available and the upload is in a container it can read from a pipe"""
+    if not FFMPEG_PATH:
+        return False
+    content_type = (file.content_type or "").split(";")[0].strip().lower()
+    ext = os.path.splitext(file.filename or "")[1].lower()
+    return content_type in STREAMABLE_AUDIO_TYPES or ext in STREAMABLE_AUDIO_EXTENSIONS
+
+
+async def tee_to_disk(file: UploadFile, path: str, hasher):
+    """Yield an upload chunk by chunk while hashing it and writing the same chunks to path"""
+    async with aiofiles.open(path, "wb") as f:
+        while chunk := await file.read(CHUNK_SIZE):
+            hasher.update(chunk)
+            await f.write(chunk)
+            yield chunk
+
+
+async def transcode(chunks):
+    """Pipe audio chunks through ffmpeg and yield the 16kHz mono Opus output"""
+    proc = await asyncio.create_subprocess_exec(
+        FFMPEG_PATH, *FFMPEG_ARGS,
+        stdin=asyncio.subprocess.PIPE,
+        stdout=asyncio.subprocess.PIPE,
+    )
+
+    async def feed():
+        try:
+            async for chunk in chunks:
+                proc.stdin.write(chunk)
+                await proc.stdin.drain()
+        finally:
+            proc.stdin.close()
+
+    feeder = asyncio.create_task(feed())
+    try:
+        while chunk := await proc.stdout.read(CHUNK_SIZE):
+            yield chunk
+        await feeder
+        if await proc.wait() != 0:
+            raise RuntimeError(f"ffmpeg exited with code {proc.returncode}")
+    finally:
+        feeder.cancel()
+        if proc.returncode is None:
+            proc.kill()
+            await proc.wait()
+
+
+async def save_and_upload(file: UploadFile) -> tuple[str, str]:
+    """Stream an upload to disk and to AssemblyAI in a single pass.
+
+    Returns the AssemblyAI upload URL and the content hash of the original audio.
+    """
+    # A 429 rewinds the upload and sends it again after a backoff, outside the
+    # semaphore. Each attempt tees into its own temp file so a late write from
+    # an abandoned attempt cannot land in the copy that is kept.
+    for attempt in range(RATE_LIMIT_RETRIES + 1):
+        await file.seek(0)
+        temp_path = temp_upload_path()
+        hasher = new_hasher()
+        chunks = tee_to_disk(file, temp_path, hasher)
+        if can_transcode(file):
+            chunks = transcode(chunks)
+        try:
+            async with STT_SEM:
+                async with http_session.post(
+                    AAI_UPLOAD_URL,
+                    data=chunks,
+                    headers={"authorization": ASSEMBLYAI_API_KEY},
+                ) as resp:
+                    if resp.status != 429 or attempt == RATE_LIMIT_RETRIES:
+                        resp.raise_for_status()
+                        data = await resp.json()
+                        break
+        except Exception:
+            if await aiofiles.os.path.exists(temp_path):
+                await aiofiles.os.remove(temp_path)
+            raise
+        if await aiofiles.os.path.exists(temp_path):
+            await aiofiles.os.remove(temp_path)
+        await asyncio.sleep(RATE_LIMIT_BACKOFF_SECONDS * 2 ** attempt)
+
+    digest = hasher.hexdigest()
+    await store_by_hash(temp_path, digest, file.filename)
+    return data["upload_url"], digest
+
+
+async def poll_transcript(transcript_id: str) -> dict:
+    """Poll AssemblyAI until the transcript is completed or errored, backing off on 429s"""
+    delay = TRANSCRIPT_POLL_SECONDS
+    while True:
+        async with STT_SEM:
+            async with http_session.get(
+                f"{AAI_TRANSCRIPT_URL}/{transcript_id}",
+                headers={"authorization": ASSEMBLYAI_API_KEY},
+            ) as resp:
+                if resp.status == 429:
+                    data = None
+                else:
+                    resp.raise_for_status()
+                    data = await resp.json()
+        if data is None:
+            delay = min(delay * 2, MAX_POLL_BACKOFF_SECONDS)
+        elif data["status"] in ("completed", "error"):
+            return data
+        else:
+            delay = TRANSCRIPT_POLL_SECONDS
+        await asyncio.sleep(delay)
+
+
+async def submit_transcript(upload_url: str) -> str:
+    """Create an AssemblyAI transcript job, retrying 429s with backoff, and return its id"""
+    for attempt in range(RATE_LIMIT_RETRIES + 1):
+        async with STT_SEM:
+            async with http_session.post(
+                AAI_TRANSCRIPT_URL,
+                json={"audio_url": upload_url},
+                headers={"authorization": ASSEMBLYAI_API_KEY},
+            ) as resp:
+                if resp.status != 429 or attempt == RATE_LIMIT_RETRIES:
+                    resp.raise_for_status()
+                    data = await resp.json()
+                    return data["id"]
+        await asyncio.sleep(RATE_LIMIT_BACKOFF_SECONDS * 2 ** attempt)
+
+
+async def submit_and_poll(upload_url: str) -> dict:
+    transcript_id = await submit_transcript(upload_url)
+    return await poll_transcript(transcript_id)
+
+
+async def transcribe(upload_url: str) -> dict:
+    """Submit already-uploaded audio to AssemblyAI and wait for the transcript JSON.
+
+    The job is submitted without waiting for it, and polling happens on the event
+    loop, so concurrent requests wait together instead of each holding a thread.
+    Raises TimeoutError after STT_TIMEOUT_SECONDS.
+    """
+    try:
+        return await asyncio.wait_for(submit_and_poll(upload_url), STT_TIMEOUT_SECONDS)
+    except asyncio.TimeoutError:
+        raise TimeoutError(f"Transcription did not finish within {STT_TIMEOUT_SECONDS}s")
+
+
+# Completed transcripts keyed by audio content hash, so a re-sent recording skips STT
+transcript_cache = LRUCache(maxsize=1024)
+
+
+async def hash_upload(file: UploadFile) -> str:
+    """Hash a spooled upload and rewind it for the next reader"""
+    hasher = new_hasher()
+    while chunk := await file.read(CHUNK_SIZE):
+        hasher.update(chunk)
+    await file.seek(0)
+    return hasher.hexdigest()
+
+
+async def transcribe_upload(file: UploadFile) -> dict:
+    """Transcribe a recording, skipping the upload entirely if the same audio was seen before"""
+    transcript = transcript_cache.get(await hash_upload(file))
+    if transcript is not None:
+        return transcript
+    upload_url, digest = await save_and_upload(file)
+    transcript = await transcribe(upload_url)
+    if transcript["status"] == "completed":
+        transcript_cache[digest] = transcript
+    return transcript
+
+
 @app.post("/transcribe/file")
 async def transcribe_file(file: UploadFile = File(...)):
     """Transcribe audio file to text using AssemblyAI"""
-    audio_data = await file.read()
-    transcriber = aai.Transcriber()
-    transcript = transcriber.transcribe(audio_data)
-    if transcript.status == aai.TranscriptStatus.error:
-        return JSONResponse({"error": transcript.error}, status_code=500)
-    return JSONResponse({"text": transcript.text})
+    check_upload_size(file)
+    try:
+        transcript = await transcribe_upload(file)
+    except TimeoutError as e:
+        return JSONResponse({"error": str(e)}, status_code=504)
+    except Exception as e:
+        return JSONResponse({"error": str(e)}, status_code=502)
+    if transcript["status"] == "error":
+        return JSONResponse({"error": transcript["error"]}, status_code=500)
+    return JSONResponse({"text": transcript["text"]})
 
 
 # ================================
@@ -147,190 +488,300 @@ async def transcribe_file(file: UploadFile = File(...)):
 @app.post("/tts/echo")
 async def tts_echo(file: UploadFile = File(...)):
     """Transcribe audio, then echo back as TTS"""
-    # Save file locally
-    temp_path = f"{UPLOAD_DIR}/{file.filename}"
-    with open(temp_path, "wb") as f:
-        content = await file.read()
-        f.write(content)
-
-    # Transcribe
-    transcriber = aai.Transcriber()
-    transcript = transcriber.transcribe(temp_path)
+    check_upload_size(file)
+    # Save file locally while uploading it to AssemblyAI, then transcribe
+    try:
+        transcript = await transcribe_upload(file)
+    except TimeoutError as e:
+        return JSONResponse({"error": str(e)}, status_code=504)
+    except Exception as e:
+        return JSONResponse({"error": str(e)}, status_code=502)
 
-    if transcript.status == aai.TranscriptStatus.error:
-        return JSONResponse({"error": transcript.error}, status_code=500)
+    if transcript["status"] == "error":
+        return JSONResponse({"error": transcript["error"]}, status_code=500)
 
-    text = transcript.text
+    text = transcript["text"]
 
     # Generate TTS
     try:
-        res = client.text_to_speech.generate(
-            text=text,
-            voice_id="en-US-natalie",
-            format="MP3"
-        )
-        return JSONResponse({"audio_url": res.audio_file})
+        audio_url = await synth(text)
+        return JSONResponse({"audio_url": audio_url})
     except ApiError as e:
         return JSONResponse({"error": e.body}, status_code=e.status_code)
 
 
 
 # ================================
-# Chat History Store (in-memory)
+# Chat History Store (Redis + in-process LRU)
 # ================================
 # Stores conversations as: { session_id: [ {"role": "...", "content": "..."} ] }
+# Redis is the shared copy across workers; the LRU keeps the hottest sessions
+# in memory as (version, history). Each save bumps chat:<id>:version in Redis,
+# so a worker only trusts its hot copy while the versions still match.
+# New turns are appended under WATCH on the version key, so two workers
+# finishing a turn for the same session at once both keep theirs.
+# Without REDIS_URL the LRU alone holds history for this process.
+REDIS_URL = os.getenv("REDIS_URL")
+HISTORY_TTL_SECONDS = 3600
+redis_client = aioredis.from_url(REDIS_URL, decode_responses=True) if REDIS_URL else None
+hot_histories = LRUCache(maxsize=256)
+
+
+async def get_history(session_id: str) -> list:
+    """Load a session's history, using the LRU copy only if Redis has not moved past it"""
+    hot = hot_histories.get(session_id)
+    if redis_client is None:
+        return list(hot[1]) if hot else []
+
+    version = await redis_client.get(f"chat:{session_id}:version")
+    if hot is not None and hot[0] == version:
+        return list(hot[1])
+    raw = await redis_client.get(f"chat:{session_id}")
+    history = json.loads(raw) if raw else []
+    hot_histories[session_id] = (version, history)
+    return list(history)
+
+
+async def append_history(session_id: str, messages: list):
+    """Append messages to the latest stored history and write it through to Redis and the LRU.
+
+    If another worker saves the session in between, the write is retried on top of its history.
+    """
+    if redis_client is None:
+        hot = hot_histories.get(session_id)
+        history = evict(list(hot[1]) if hot else []) + messages
+        hot_histories[session_id] = (None, history)
+        return
+
+    version_key = f"chat:{session_id}:version"
+    async with redis_client.pipeline(transaction=True) as pipe:
+        while True:
+            try:
+                await pipe.watch(version_key)
+                version = await pipe.get(version_key)
+                hot = hot_histories.get(session_id)
+                if hot is not None and hot[0] == version:
+                    history = list(hot[1])
+                else:
+                    raw = await pipe.get(f"chat:{session_id}")
+                    history = json.loads(raw) if raw else []
+                history = evict(history) + messages
+
+                pipe.multi()
+                pipe.set(f"chat:{session_id}", json.dumps(history), ex=HISTORY_TTL_SECONDS)
+                pipe.incr(version_key)
+                pipe.expire(version_key, HISTORY_TTL_SECONDS)
+                _, version, _ = await pipe.execute()
+                break
+            except WatchError:
+                continue
+    hot_histories[session_id] = (str(version), history)
+
+
+@app.on_event("shutdown")
+async def close_redis():
+    """Close the Redis connection pool"""
+    if redis_client is not None:
+        await redis_client.aclose()
+
+# Once a session exceeds HISTORY_MAX_MESSAGES, everything but the last
+# HISTORY_KEEP_RECENT messages is folded into one summary message at index 0.
+# Evicting in batches keeps the prompt prefix unchanged for several turns.
+HISTORY_MAX_MESSAGES = 20
+HISTORY_KEEP_RECENT = 10
+SUMMARY_MAX_LINES = 40
+SUMMARY_LINE_CHARS = 200
+
+
+def evict(history: list) -> list:
+    """Bound a session's history; running it twice gives the same result"""
+    summary = history[0] if history and history[0]["role"] == "summary" else None
+    if len(history) - (summary is not None) <= HISTORY_MAX_MESSAGES:
+        return history
+
+    messages = [m for m in history if m["role"] in ("user", "assistant")]
+    if len(messages) <= HISTORY_MAX_MESSAGES:
+        return ([summary] if summary else []) + messages
+
+    older, recent = messages[:-HISTORY_KEEP_RECENT], messages[-HISTORY_KEEP_RECENT:]
+    lines = summary["content"].split("\n")[1:] if summary else []
+    # One line per message: collapse newlines so the line cap counts messages
+    lines += [f"{m['role']}: {' '.join(m['content'].split())[:SUMMARY_LINE_CHARS]}" for m in older]
+    lines = lines[-SUMMARY_MAX_LINES:]
+    summary = {"role": "summary", "content": "\n".join(["Earlier in this conversation:"] + lines)}
+    return [summary] + recent
+
+
+# Gemini chat sessions, kept per session_id so a turn only appends to an
+# existing ChatSession instead of rebuilding the prompt from scratch.
+chat_sessions = LRUCache(maxsize=256)
+
+
+def to_gemini_history(history: list) -> list:
+    """Convert stored messages into Gemini content dicts (summary becomes a user/model pair)"""
+    contents = []
+    for m in history:
+        if m["role"] == "summary":
+            contents.append({"role": "user", "parts": [m["content"]]})
+            contents.append({"role": "model", "parts": ["Understood."]})
+        else:
+            contents.append({"role": "model" if m["role"] == "assistant" else "user", "parts": [m["content"]]})
+    return contents
 
 
+def gemini_turn_count(history: list) -> int:
+    """Number of Gemini turns to_gemini_history would produce, without building them"""
+    return len(history) + (1 if history and history[0]["role"] == "summary" else 0)
 
-from fastapi import Body, Form
 
-@app.post("/agent/chat/{session_id}")
-async def agent_chat(
-    session_id: str,
-    file: UploadFile = File(None),   # For audio from FormData
-    text: str = Form(None)           # Accepts text from FormData too
-):
-    try:
-        # -------------------------
-        # Handle voice input
-        # -------------------------
-        if file:
-            temp_path = os.path.join(UPLOAD_DIR, file.filename)
-            with open(temp_path, "wb") as f:
-                f.write(await file.read())
-
-            transcriber = aai.Transcriber()
-            transcript = transcriber.transcribe(temp_path)
-            if transcript.status == aai.TranscriptStatus.error:
-                return JSONResponse({"error": transcript.error}, status_code=500)
-            user_text = transcript.text
-
-        # -------------------------
-        # Handle text input
-        # -------------------------
-        elif text:
-            user_text = text.strip()
+def get_chat(session_id: str, history: list):
+    """Return the session's Gemini chat, rebuilding it when it no longer matches history.
 
-        else:
-            return JSONResponse({"error": "No file or text provided"}, status_code=400)
-
-        # Get previous chat history
-        history = chat_history_store.get(session_id, [])
-        history.append({"role": "user", "content": user_text})
-
-        # Prepare conversation text
-        conversation_text = "\n".join([f"{m['role']}: {m['content']}" for m in history])
-
-        # Generate LLM reply
-        llm_response = llm_model.generate_content(conversation_text)
-        bot_text = llm_response.text
+    A mismatch happens after eviction, after a failed LLM call, or when another
+    worker has advanced the session in Redis. Only a rebuild converts the history,
+    so an ordinary turn does no per-message work.
+    """
+    chat = chat_sessions.get(session_id)
+    try:
+        stale = chat is None or len(chat.history) != gemini_turn_count(history)
+    except Exception:
+        # A blocked or interrupted reply leaves the chat unreadable (BrokenResponseError)
+        stale = True
+    if stale:
+        chat = llm_model.start_chat(history=to_gemini_history(history))
+        chat_sessions[session_id] = chat
+    return chat
 
-        # Save bot reply
-        history.append({"role": "assistant", "content": bot_text})
-        chat_history_store[session_id] = history
 
-        # Generate speech from bot text
-        res = client.text_to_speech.generate(
-            text=bot_text,
-            voice_id="en-US-natalie",
-            format="MP3"
-        )
+# ================================
+# Fallback Audio
+# ================================
+FALLBACK_MESSAGE = "I'm having trouble connecting right now."
+FALLBACK_AUDIO_PATH = os.path.join(GENERATED_AUDIO_DIR, "fallback.mp3")
+FALLBACK_AUDIO_URL = f"/audio/{os.path.basename(FALLBACK_AUDIO_PATH)}"
+fallback_task: asyncio.Task | None = None
 
-        return {
-            "transcription": user_text,
-            "llm_text": bot_text,
-            "audio_url": res.audio_file
-        }
 
+async def download_audio(url: str, path: str):
+    """Download a synthesized audio file to path, so it is never served half-written"""
+    async with http_session.get(url) as resp:
+        resp.raise_for_status()
+        audio_bytes = await resp.read()
+    temp_path = f"{path}.{uuid.uuid4()}.part"
+    try:
+        async with aiofiles.open(temp_path, "wb") as f:
+            await f.write(audio_bytes)
+        await aiofiles.os.replace(temp_path, path)
+    except Exception:
+        if await aiofiles.os.path.exists(temp_path):
+            await aiofiles.os.remove(temp_path)
+        raise
+
+
+async def generate_fallback_audio():
+    """Synthesize the fallback message and store it locally, unless a non-empty copy exists"""
+    if os.path.exists(FALLBACK_AUDIO_PATH) and os.path.getsize(FALLBACK_AUDIO_PATH) > 0:
+        return
+    try:
+        remote_url = await synth(FALLBACK_MESSAGE)
+        await download_audio(remote_url, FALLBACK_AUDIO_PATH)
     except Exception as e:
-        return JSONResponse({"error": str(e)}, status_code=500)
+        print("❌ Failed to pre-generate fallback audio:", e)
 
 
+@app.on_event("startup")
+async def pregenerate_fallback_audio():
+    """Generate fallback audio in the background so startup does not wait on Murf"""
+    global fallback_task
+    fallback_task = asyncio.create_task(generate_fallback_audio())
 
 
 # ================================
-# Chat History Store (in-memory)
+# Routes - Conversational Agent
 # ================================
-chat_history_store = {}
+# Murf already hosts the audio, so replies link to it directly. Set
+# STORE_AUDIO_LOCALLY=true to also keep a copy in GENERATED_AUDIO_DIR for retention;
+# the copy is written in the background and never delays the response.
+STORE_AUDIO_LOCALLY = os.getenv("STORE_AUDIO_LOCALLY", "false").lower() == "true"
+background_tasks = set()
 
-FALLBACK_MESSAGE = "I'm having trouble connecting right now."
-FALLBACK_AUDIO_PATH = os.path.join(UPLOAD_DIR, "/Frontend/fallback.mp3") # Put fallback.mp3 in your 'static' folder
 
+async def store_audio_copy(remote_url: str):
+    """Keep a local copy of a reply's audio"""
+    try:
+        await download_audio(remote_url, os.path.join(GENERATED_AUDIO_DIR, f"{uuid.uuid4()}.mp3"))
+    except Exception as e:
+        print("❌ Failed to store audio locally:", e)
 
-# Generate fallback audio once at startup if not already present
-def generate_fallback_audio():
-    if not os.path.exists(FALLBACK_AUDIO_PATH):
-        try:
-            res = client.text_to_speech.generate(
-                text=FALLBACK_MESSAGE,
-                voice_id="en-US-natalie",
-                format="MP3"
-            )
-            with open(FALLBACK_AUDIO_PATH, "wb") as f:
-                f.write(res.audio_file.read())
-        except Exception as e:
-            print("❌ Failed to pre-generate fallback audio:", e)
 
-generate_fallback_audio()
+def keep_audio_copy(remote_url: str):
+    """Store a reply's audio in the background when STORE_AUDIO_LOCALLY is set"""
+    if STORE_AUDIO_LOCALLY:
+        task = asyncio.create_task(store_audio_copy(remote_url))
+        background_tasks.add(task)
+        task.add_done_callback(background_tasks.discard)
 
 
 @app.post("/agent/chat/{session_id}")
-async def agent_chat(session_id: str, file: UploadFile = File(...)):
-    try:
-        # 1. Save audio locally
-        temp_path = os.path.join(UPLOAD_DIR, file.filename)
-        with open(temp_path, "wb") as f:
-            f.write(await file.read())
+async def agent_chat(
+    session_id: str,
+    file: UploadFile = File(None),   # For audio from FormData
+    text: str = Form(None)           # Accepts text from FormData too
+):
+    if file:
+        check_upload_size(file)
 
-        # 2. Transcribe with AssemblyAI (STT)
-        try:
-            transcriber = aai.Transcriber()
-            transcript = transcriber.transcribe(temp_path)
-            if transcript.status == aai.TranscriptStatus.error:
-                raise Exception(transcript.error)
-            user_text = transcript.text
-        except Exception as e:
-            print("❌ STT failed:", e)
-            return {
-                "transcription": "(STT failed)",
-                "llm_text": FALLBACK_MESSAGE,
-                "audio_url": f"/uploads/{os.path.basename(FALLBACK_AUDIO_PATH)}"
-            }
+    user_text = ""
+    try:
+        # 1. Voice input: save audio locally while uploading it to AssemblyAI (STT)
+        if file:
+            try:
+                transcript = await transcribe_upload(file)
+                if transcript["status"] == "error":
+                    raise Exception(transcript["error"])
+                user_text = transcript["text"]
+            except Exception as e:
+                print("❌ STT failed:", e)
+                return {
+                    "transcription": "(STT failed)",
+                    "llm_text": FALLBACK_MESSAGE,
+                    "audio_url": FALLBACK_AUDIO_URL
+                }
+
+        # 1b. Text input
+        elif text:
+            user_text = text.strip()
 
-        # 3. Get previous messages
-        history = chat_history_store.get(session_id, [])
-        history.append({"role": "user", "content": user_text})
+        else:
+            return JSONResponse({"error": "No file or text provided"}, status_code=400)
 
-        # 4. Prepare prompt for LLM
-        conversation_text = "\n".join([f"{m['role']}: {m['content']}" for m in history])
+        # 2. Get previous messages and the matching Gemini chat
+        history = evict(await get_history(session_id))
+        chat = get_chat(session_id, history)
 
-        # 5. LLM response
+        # 3. LLM response (only the new user message is added to the chat)
         try:
-            llm_response = llm_model.generate_content(conversation_text)
+            llm_response = await chat.send_message_async(user_text)
             bot_text = llm_response.text
         except Exception as e:
             print("❌ LLM failed:", e)
             bot_text = FALLBACK_MESSAGE
+            # The failed reply stays in the ChatSession; drop it so the next turn rebuilds
+            chat_sessions.pop(session_id, None)
 
-        # 6. Append bot reply to history
-        history.append({"role": "assistant", "content": bot_text})
-        chat_history_store[session_id] = history
+        # 4. Append both turns to history
+        await append_history(session_id, [
+            {"role": "user", "content": user_text},
+            {"role": "assistant", "content": bot_text},
+        ])
 
-        # 7. TTS generation
+        # 5. TTS generation
         try:
-            res = client.text_to_speech.generate(
-                text=bot_text,
-                voice_id="en-US-natalie",
-                format="MP3"
-            )
-            audio_filename = f"{uuid.uuid4()}.mp3"
-            audio_path = os.path.join(UPLOAD_DIR, audio_filename)
-            with open(audio_path, "wb") as f:
-                f.write(res.audio_file.read())
-            audio_url = f"/uploads/{audio_filename}"
+            audio_url = await synth(bot_text)
+            keep_audio_copy(audio_url)
         except Exception as e:
             print("❌ TTS failed:", e)
-            audio_url = f"/uploads/{os.path.basename(FALLBACK_AUDIO_PATH)}"
+            audio_url = FALLBACK_AUDIO_URL
 
         return {
             "transcription": user_text,
@@ -339,13 +790,121 @@ async def agent_chat(session_id: str, file: UploadFile = File(...)):
         }
 
     except Exception as e:
-         # ==== This block handles ALL errors ====
+        # ==== This block handles ALL errors ====
         print("Error in pipeline:", e)
         return JSONResponse(
             {
-                "transcription": user_text or "",
+                "transcription": user_text,
                 "llm_text": FALLBACK_MESSAGE,
-                "audio_url": FALLBACK_AUDIO_PATH
+                "audio_url": FALLBACK_AUDIO_URL
             },
             status_code=500
         )
+
+
+# ================================
+# Streaming Chat Pipeline
+# ================================
+# A sentence ends at a terminator followed by whitespace
+SENTENCE_END = re.compile(r"[.!?]\s")
+
+
+def fallback_stream(transcription: str) -> StreamingResponse:
+    """NDJSON response carrying only the fallback message, used when the pipeline fails early"""
+    async def events():
+        yield json.dumps({"transcription": transcription}) + "\n"
+        yield json.dumps({"text": FALLBACK_MESSAGE, "audio_url": FALLBACK_AUDIO_URL}) + "\n"
+
+    return StreamingResponse(events(), media_type="application/x-ndjson")
+
+
+@app.post("/agent/chat/{session_id}/stream")
+async def agent_chat_stream(
+    session_id: str,
+    file: UploadFile = File(None),
+    text: str = Form(None)
+):
+    """Chat turn that streams NDJSON: the transcription first, then one audio URL per sentence"""
+    if file:
+        check_upload_size(file)
+        try:
+            transcript = await transcribe_upload(file)
+            if transcript["status"] == "error":
+                raise Exception(transcript["error"])
+            user_text = transcript["text"]
+        except Exception as e:
+            print("❌ STT failed:", e)
+            return fallback_stream("(STT failed)")
+    elif text:
+        user_text = text.strip()
+    else:
+        return JSONResponse({"error": "No file or text provided"}, status_code=400)
+
+    try:
+        history = evict(await get_history(session_id))
+        chat = get_chat(session_id, history)
+    except Exception as e:
+        print("Error in pipeline:", e)
+        return fallback_stream(user_text)
+
+    # (sentence, TTS task) pairs in reply order; None marks the end of the reply
+    sentence_queue = asyncio.Queue()
+
+    async def queue_sentence(sentence: str):
+        await sentence_queue.put((sentence, asyncio.create_task(synth(sentence))))
+
+    async def produce():
+        """Stream the Gemini reply and start TTS on each sentence as soon as it is complete"""
+        sentences = []
+        buf = ""
+        scan_from = 0
+        try:
+            response = await chat.send_message_async(user_text, stream=True)
+            async for chunk in response:
+                buf += chunk.text
+                start = 0
+                for match in SENTENCE_END.finditer(buf, scan_from):
+                    sentence = buf[start:match.end()].strip()
+                    start = match.end()
+                    sentences.append(sentence)
+                    await queue_sentence(sentence)
+                buf = buf[start:]
+                # Only the last character can still begin a match once more text arrives
+                scan_from = max(len(buf) - 1, 0)
+        except Exception as e:
+            print("❌ LLM failed:", e)
+            buf = "" if sentences else FALLBACK_MESSAGE
+            # The failed reply stays in the ChatSession; drop it so the next turn rebuilds
+            chat_sessions.pop(session_id, None)
+        if buf.strip():
+            sentences.append(buf.strip())
+            await queue_sentence(buf.strip())
+        await sentence_queue.put(None)
+
+        try:
+            await append_history(session_id, [
+                {"role": "user", "content": user_text},
+                {"role": "assistant", "content": " ".join(sentences)},
+            ])
+        except Exception as e:
+            print("Error in pipeline:", e)
+
+    async def events():
+        yield json.dumps({"transcription": user_text}) + "\n"
+        # Held in background_tasks so the history save still runs if the client disconnects
+        producer = asyncio.create_task(produce())
+        background_tasks.add(producer)
+        producer.add_done_callback(background_tasks.discard)
+        # Emit in sentence order so the client can play the chunks back to back
+        while (item := await sentence_queue.get()) is not None:
+            sentence, task = item
+            try:
+                audio_url = await task
+                keep_audio_copy(audio_url)
+            except Exception as e:
+                print("❌ TTS failed:", e)
+                audio_url = FALLBACK_AUDIO_URL
+            yield json.dumps({"text": sentence, "audio_url": audio_url}) + "\n"
+        await producer
+
+    return StreamingResponse(events(), media_type="application/x-ndjson")